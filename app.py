@@ -1,7 +1,9 @@
+import os
 from flask import Flask
-from models import initialize_db, populate_initial_data
+from models import db, initialize_db, populate_initial_data, begin_unit_of_work, end_unit_of_work
 from blueprints.masters.routes import masters_bp
 from blueprints.appointments.routes import appointments_bp
+from capture import init_capture, init_query_counter
 
 app = Flask(__name__)
 
@@ -9,10 +11,29 @@ app = Flask(__name__)
 app.register_blueprint(masters_bp)
 app.register_blueprint(appointments_bp)
 
+# Соединение открывается на время запроса и возвращается в пул после него
+@app.before_request
+def open_db_connection():
+    db.connect(reuse_if_open=True)
+    begin_unit_of_work()
+
+@app.teardown_request
+def close_db_connection(exc):
+    end_unit_of_work()
+    if not db.is_closed():
+        db.close()
+
+# Запись трафика для replay.py и подсчет SQL-запросов
+if os.environ.get('QUERY_COUNT_HEADER'):
+    init_query_counter(app)
+if os.environ.get('CAPTURE_LOG'):
+    init_capture(app, os.environ['CAPTURE_LOG'])
+
 # Инициализация базы данных
 with app.app_context():
     initialize_db()
     populate_initial_data()
+    db.close()
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,25 @@
+"""Перенос старых записей в архив.
+
+Запускается по расписанию, например из cron:
+    python archive.py --days 30
+"""
+import argparse
+from datetime import datetime, timedelta
+from models import db, initialize_db, archive_appointments
+
+ARCHIVE_AFTER_DAYS = 30
+
+def main():
+    parser = argparse.ArgumentParser(description='Архивация старых записей')
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                        help='Архивировать записи старше указанного числа дней')
+    args = parser.parse_args()
+
+    initialize_db()
+    before = datetime.now() - timedelta(days=args.days)
+    moved = archive_appointments(before)
+    print(f"Перенесено в архив записей: {moved}")
+    db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Замер времени выдачи GET /appointments/ при росте истории записей.
+
+Сравнивает листинг без архивации и после переноса истории в архив:
+    python bench_archive.py --history 1000 10000 50000
+    python bench_archive.py --postgres
+    python bench_archive.py --database-url postgresext+pool://localhost/barbershop_bench
+
+Бенчмарк очищает таблицы записей, поэтому --database-url должен указывать на отдельную базу.
+"""
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+import pgtemp
+
+def run(history, upcoming, repeat):
+    from models import (db, Appointment, AppointmentService, ArchivedAppointment,
+                        ArchivedAppointmentService, AppointmentCatalog, archive_appointments,
+                        next_ids, APPOINTMENT_SEQUENCE)
+    from app import app
+
+    now = datetime.now()
+    with db.atomic():
+        for model in (AppointmentCatalog, ArchivedAppointmentService, ArchivedAppointment,
+                      AppointmentService, Appointment):
+            model.delete().execute()
+        rows = [{'client_name': f'Клиент {i}', 'client_phone': '12345',
+                 'date': now - timedelta(days=30 + i % 3000), 'master': 1}
+                for i in range(history)]
+        rows += [{'client_name': f'Клиент {i}', 'client_phone': '12345',
+                  'date': now + timedelta(hours=i), 'master': 1}
+                 for i in range(upcoming)]
+        # insert_many обходит Appointment.save, поэтому id берем из общей последовательности сами
+        first_id = next_ids(APPOINTMENT_SEQUENCE, len(rows))
+        for offset, row in enumerate(rows):
+            row['id'] = first_id + offset
+        for i in range(0, len(rows), 500):
+            Appointment.insert_many(rows[i:i + 500]).execute()
+
+    client = app.test_client()
+    headers = {'api_key': 'user_readonly_key_456'}
+
+    def measure():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            # Тело ответа отдается потоком, поэтому читаем его целиком
+            client.get('/appointments/', headers=headers).get_data()
+        return (time.perf_counter() - start) / repeat * 1000
+
+    before = measure()
+    archive_appointments(now - timedelta(days=14))
+    after = measure()
+    print(f"история={history:>7}  без архива={before:9.2f} мс  с архивом={after:9.2f} мс")
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк листинга записей')
+    parser.add_argument('--history', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--upcoming', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    backend = parser.add_mutually_exclusive_group()
+    backend.add_argument('--database-url', help='База для замера (по умолчанию временный SQLite)')
+    backend.add_argument('--postgres', action='store_true',
+                         help='Поднять временный PostgreSQL (initdb/pg_ctl или docker)')
+    args = parser.parse_args()
+
+    # Бенчмарк работает во временном каталоге, чтобы не трогать рабочую базу
+    os.chdir(tempfile.mkdtemp())
+    with contextlib.ExitStack() as stack:
+        if args.postgres:
+            os.environ['DATABASE_URL'] = stack.enter_context(pgtemp.temporary_postgres())
+        elif args.database_url:
+            os.environ['DATABASE_URL'] = args.database_url
+        for history in args.history:
+            run(history, args.upcoming, args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,10 @@
 from flask import Blueprint, request, jsonify, Response
-from models import Appointment, Master, Service, AppointmentService
+from models import (Appointment, Master, Service, AppointmentService, ArchivedAppointment,
+                    appointments_query, get_appointment_any, AppointmentCatalog,
+                    appointment_catalog, iterate_chunks, unit_of_work, write_transaction)
 from auth import require_api_key, require_admin
+from idempotency import idempotent
+from negotiation import negotiated_stream
 import json
 from datetime import datetime
 from peewee import IntegrityError
@@ -13,41 +17,56 @@ def get_appointments():
     """Получить все записи с услугами"""
     sort_by = request.args.get('sort_by', 'date')
     direction = request.args.get('direction', 'asc')
+    include_archived = request.args.get('include_archived') == '1'
 
     valid_sort_fields = ['date', 'status', 'client_name']
     if sort_by not in valid_sort_fields:
         sort_by = 'date'
 
-    query = Appointment.select()
+    query = appointments_query(include_archived)
     if direction == 'desc':
         query = query.order_by(getattr(Appointment, sort_by).desc())
     else:
         query = query.order_by(getattr(Appointment, sort_by))
 
-    appointments = []
-    for appointment in query:
-        appointments.append({
-            'id': appointment.id,
-            'client_name': appointment.client_name,
-            'client_phone': appointment.client_phone,
-            'date': appointment.date.isoformat(),
-            'status': appointment.status,
-            'comment': appointment.comment,
-            'master': {
-                'id': appointment.master.id,
-                'first_name': appointment.master.first_name,
-                'last_name': appointment.master.last_name
-            },
-            'services': [aps.service.id for aps in AppointmentService.select().where(AppointmentService.appointment == appointment)]
-        })
-    return jsonify({'appointments': appointments})
+    # Ответ пишется потоком уже после выхода из обработчика, поэтому карта
+    # идентичности запроса берется заранее
+    uow = unit_of_work()
+
+    def appointments():
+        for chunk in iterate_chunks(query):
+            catalog = appointment_catalog([appointment.id for appointment in chunk])
+            # Мастера пачки загружаются одним запросом и дальше берутся из карты
+            uow.load(Master, {appointment.master_id for appointment in chunk})
+            items = []
+            for appointment in chunk:
+                services, total_price = catalog[appointment.id]
+                master = uow.get(Master, appointment.master_id)
+                items.append({
+                    'id': appointment.id,
+                    'client_name': appointment.client_name,
+                    'client_phone': appointment.client_phone,
+                    'date': appointment.date.isoformat(),
+                    'status': appointment.status,
+                    'comment': appointment.comment,
+                    'master': {
+                        'id': master.id,
+                        'first_name': master.first_name,
+                        'last_name': master.last_name
+                    },
+                    'services': services,
+                    'total_price': str(total_price)
+                })
+            yield items
+    return negotiated_stream('appointments', appointments())
 
 @appointments_bp.route('/<int:appointment_id>', methods=['GET'])
 @require_api_key
 def get_appointment(appointment_id):
     """Получить запись по ID с услугами"""
     try:
-        appointment = Appointment.get(Appointment.id == appointment_id)
+        appointment = get_appointment_any(appointment_id)
+        services, total_price = appointment_catalog([appointment.id])[appointment.id]
         return jsonify({
             'id': appointment.id,
             'client_name': appointment.client_name,
@@ -60,7 +79,8 @@ def get_appointment(appointment_id):
                 'first_name': appointment.master.first_name,
                 'last_name': appointment.master.last_name
             },
-            'services': [aps.service.id for aps in AppointmentService.select().where(AppointmentService.appointment == appointment)]
+            'services': services,
+            'total_price': str(total_price)
         })
     except Appointment.DoesNotExist:
         return Response(
@@ -73,19 +93,30 @@ def get_appointment(appointment_id):
 @require_api_key
 def get_appointments_by_master(master_id):
     """Получить записи по мастеру с услугами"""
+    include_archived = request.args.get('include_archived') == '1'
     try:
-        appointments = []
-        for appointment in Appointment.select().where(Appointment.master == master_id):
-            appointments.append({
-                'id': appointment.id,
-                'client_name': appointment.client_name,
-                'client_phone': appointment.client_phone,
-                'date': appointment.date.isoformat(),
-                'status': appointment.status,
-                'comment': appointment.comment,
-                'services': [aps.service.id for aps in AppointmentService.select().where(AppointmentService.appointment == appointment)]
-            })
-        return jsonify({'appointments': appointments})
+        query = Appointment.select().where(Appointment.master == master_id)
+        if include_archived:
+            query = query + ArchivedAppointment.select().where(ArchivedAppointment.master == master_id)
+
+        def appointments():
+            for chunk in iterate_chunks(query):
+                catalog = appointment_catalog([appointment.id for appointment in chunk])
+                items = []
+                for appointment in chunk:
+                    services, total_price = catalog[appointment.id]
+                    items.append({
+                        'id': appointment.id,
+                        'client_name': appointment.client_name,
+                        'client_phone': appointment.client_phone,
+                        'date': appointment.date.isoformat(),
+                        'status': appointment.status,
+                        'comment': appointment.comment,
+                        'services': services,
+                        'total_price': str(total_price)
+                    })
+                yield items
+        return negotiated_stream('appointments', appointments())
     except Master.DoesNotExist:
         return Response(
             json.dumps({"error": "Мастер не найден"}, ensure_ascii=False),
@@ -95,6 +126,7 @@ def get_appointments_by_master(master_id):
 
 @appointments_bp.route('/', methods=['POST'])
 @require_admin
+@idempotent
 def create_appointment():
     """Создать новую запись с услугами"""
     data = request.get_json()
@@ -107,22 +139,22 @@ def create_appointment():
         )
 
     try:
-        appointment = Appointment.create(
-            client_name=data['client_name'],
-            client_phone=data['client_phone'],
-            date=datetime.fromisoformat(data['date']),
-            status=data.get('status', 'ожидает'),
-            comment=data.get('comment'),
-            master=data['master_id']
-        )
+        uow = unit_of_work()
+        # Строка и ее связи с услугами пишутся одной транзакцией
+        with write_transaction():
+            appointment = Appointment.create(
+                client_name=data['client_name'],
+                client_phone=data['client_phone'],
+                date=datetime.fromisoformat(data['date']),
+                status=data.get('status', 'ожидает'),
+                comment=data.get('comment'),
+                master=uow.get(Master, data['master_id'])
+            )
+            uow.remember(appointment)
 
-        # Добавляем услуги к записи, если они указаны
-        if 'services' in data:
-            for service_id in data['services']:
-                AppointmentService.create(
-                    appointment=appointment,
-                    service=service_id
-                )
+            # Добавляем услуги к записи, если они указаны
+            uow.add_links(AppointmentService, 'appointment', appointment.id, data.get('services', []))
+            uow.flush()
 
         return jsonify({
             'id': appointment.id,
@@ -134,7 +166,7 @@ def create_appointment():
             'master': appointment.master.id,
             'services': data.get('services', [])
         }), 201
-    except (Master.DoesNotExist, ValueError) as e:
+    except (Master.DoesNotExist, ValueError, IntegrityError) as e:
         return Response(
             json.dumps({"error": str(e)}, ensure_ascii=False),
             status=400,
@@ -154,29 +186,28 @@ def update_appointment(appointment_id):
         )
 
     try:
-        appointment = Appointment.get(Appointment.id == appointment_id)
-        if 'client_name' in data:
-            appointment.client_name = data['client_name']
-        if 'client_phone' in data:
-            appointment.client_phone = data['client_phone']
-        if 'date' in data:
-            appointment.date = datetime.fromisoformat(data['date'])
-        if 'status' in data:
-            appointment.status = data['status']
-        if 'comment' in data:
-            appointment.comment = data['comment']
-        if 'master_id' in data:
-            appointment.master = data['master_id']
-        appointment.save()
-
-        # Обновляем услуги записи
-        if 'services' in data:
-            AppointmentService.delete().where(AppointmentService.appointment == appointment).execute()
-            for service_id in data['services']:
-                AppointmentService.create(
-                    appointment=appointment,
-                    service=service_id
-                )
+        uow = unit_of_work()
+        # Строка и ее связи с услугами пишутся одной транзакцией
+        with write_transaction():
+            appointment = uow.get(Appointment, appointment_id)
+            if 'client_name' in data:
+                appointment.client_name = data['client_name']
+            if 'client_phone' in data:
+                appointment.client_phone = data['client_phone']
+            if 'date' in data:
+                appointment.date = datetime.fromisoformat(data['date'])
+            if 'status' in data:
+                appointment.status = data['status']
+            if 'comment' in data:
+                appointment.comment = data['comment']
+            if 'master_id' in data:
+                appointment.master = uow.get(Master, data['master_id'])
+            appointment.save()
+
+            # Обновляем услуги записи
+            if 'services' in data:
+                uow.add_links(AppointmentService, 'appointment', appointment.id, data['services'], replace=True)
+            uow.flush()
 
         return jsonify({
             'id': appointment.id,
@@ -194,17 +225,26 @@ def update_appointment(appointment_id):
             status=404,
             mimetype="application/json; charset=utf-8"
         )
+    except (Master.DoesNotExist, ValueError, IntegrityError) as e:
+        return Response(
+            json.dumps({"error": str(e)}, ensure_ascii=False),
+            status=400,
+            mimetype="application/json; charset=utf-8"
+        )
 
 @appointments_bp.route('/<int:appointment_id>', methods=['DELETE'])
 @require_admin
 def delete_appointment(appointment_id):
     """Удалить запись"""
     try:
-        appointment = Appointment.get(Appointment.id == appointment_id)
-        # Удаляем все услуги записи
-        AppointmentService.delete().where(AppointmentService.appointment == appointment).execute()
-        # Удаляем запись
-        appointment.delete_instance()
+        # Запись, ее услуги и строка каталога удаляются вместе
+        with write_transaction():
+            appointment = unit_of_work().get(Appointment, appointment_id)
+            # Удаляем все услуги записи
+            AppointmentService.delete().where(AppointmentService.appointment == appointment).execute()
+            AppointmentCatalog.delete().where(AppointmentCatalog.appointment_id == appointment.id).execute()
+            # Удаляем запись
+            appointment.delete_instance()
         return Response(
             json.dumps({"message": "Запись удалена"}, ensure_ascii=False),
             status=200,
@@ -1,6 +1,10 @@
 from flask import Blueprint, request, jsonify, Response
-from models import Master, Service, MasterService, Appointment
+from models import (Master, Service, MasterService, Appointment, AppointmentService,
+                    ArchivedAppointment, ArchivedAppointmentService, MasterCatalog, AppointmentCatalog,
+                    master_catalog, iterate_chunks, unit_of_work, write_transaction)
 from auth import require_api_key, require_admin
+from idempotency import idempotent
+from negotiation import negotiated_stream
 import json
 from peewee import IntegrityError
 
@@ -10,31 +14,33 @@ masters_bp = Blueprint('masters', __name__, url_prefix='/masters')
 @require_api_key
 def get_masters():
     """Получить список всех мастеров с их услугами"""
-    masters = []
-    for master in Master.select():
-        masters.append({
-            'id': master.id,
-            'first_name': master.first_name,
-            'last_name': master.last_name,
-            'middle_name': master.middle_name,
-            'phone': master.phone,
-            'services': [ms.service.id for ms in MasterService.select().where(MasterService.master == master)]
-        })
-    return jsonify({'masters': masters})
+    def masters():
+        # Мастера читаются курсором пачками, каталог услуг - одним запросом на пачку
+        for chunk in iterate_chunks(Master.select()):
+            catalog = master_catalog([master.id for master in chunk])
+            yield [{
+                'id': master.id,
+                'first_name': master.first_name,
+                'last_name': master.last_name,
+                'middle_name': master.middle_name,
+                'phone': master.phone,
+                'services': catalog.get(master.id, [])
+            } for master in chunk]
+    return negotiated_stream('masters', masters())
 
 @masters_bp.route('/<int:master_id>', methods=['GET'])
 @require_api_key
 def get_master(master_id):
     """Получить информацию о мастере по ID с его услугами"""
     try:
-        master = Master.get(Master.id == master_id)
+        master = unit_of_work().get(Master, master_id)
         return jsonify({
             'id': master.id,
             'first_name': master.first_name,
             'last_name': master.last_name,
             'middle_name': master.middle_name,
             'phone': master.phone,
-            'services': [ms.service.id for ms in MasterService.select().where(MasterService.master == master)]
+            'services': master_catalog([master.id]).get(master.id, [])
         })
     except Master.DoesNotExist:
         return Response(
@@ -45,6 +51,7 @@ def get_master(master_id):
 
 @masters_bp.route('/', methods=['POST'])
 @require_admin
+@idempotent
 def create_master():
     """Создать нового мастера с услугами"""
     data = request.get_json()
@@ -57,17 +64,21 @@ def create_master():
         )
 
     try:
-        master = Master.create(
-            first_name=data['first_name'],
-            last_name=data['last_name'],
-            middle_name=data.get('middle_name'),
-            phone=data['phone']
-        )
+        uow = unit_of_work()
+        # Строка и ее связи с услугами пишутся одной транзакцией
+        with write_transaction():
+            master = Master.create(
+                first_name=data['first_name'],
+                last_name=data['last_name'],
+                middle_name=data.get('middle_name'),
+                phone=data['phone']
+            )
+
+            uow.remember(master)
 
-        # Добавляем услуги мастера, если они указаны
-        if 'services' in data:
-            for service_id in data['services']:
-                MasterService.create(master=master, service=service_id)
+            # Добавляем услуги мастера, если они указаны
+            uow.add_links(MasterService, 'master', master.id, data.get('services', []))
+            uow.flush()
 
         return jsonify({
             'id': master.id,
@@ -97,22 +108,24 @@ def update_master(master_id):
         )
 
     try:
-        master = Master.get(Master.id == master_id)
-        if 'first_name' in data:
-            master.first_name = data['first_name']
-        if 'last_name' in data:
-            master.last_name = data['last_name']
-        if 'middle_name' in data:
-            master.middle_name = data['middle_name']
-        if 'phone' in data:
-            master.phone = data['phone']
-        master.save()
+        uow = unit_of_work()
+        # Строка и ее связи с услугами пишутся одной транзакцией
+        with write_transaction():
+            master = uow.get(Master, master_id)
+            if 'first_name' in data:
+                master.first_name = data['first_name']
+            if 'last_name' in data:
+                master.last_name = data['last_name']
+            if 'middle_name' in data:
+                master.middle_name = data['middle_name']
+            if 'phone' in data:
+                master.phone = data['phone']
+            master.save()
 
-        # Обновляем услуги мастера
-        if 'services' in data:
-            MasterService.delete().where(MasterService.master == master).execute()
-            for service_id in data['services']:
-                MasterService.create(master=master, service=service_id)
+            # Обновляем услуги мастера
+            if 'services' in data:
+                uow.add_links(MasterService, 'master', master.id, data['services'], replace=True)
+            uow.flush()
 
         return jsonify({
             'id': master.id,
@@ -128,19 +141,36 @@ def update_master(master_id):
             status=404,
             mimetype="application/json; charset=utf-8"
         )
+    except IntegrityError as e:
+        return Response(
+            json.dumps({"error": str(e)}, ensure_ascii=False),
+            status=400,
+            mimetype="application/json; charset=utf-8"
+        )
 
 @masters_bp.route('/<int:master_id>', methods=['DELETE'])
 @require_admin
 def delete_master(master_id):
     """Удалить мастера"""
     try:
-        master = Master.get(Master.id == master_id)
-        # Удаляем все связанные записи
-        Appointment.delete().where(Appointment.master == master).execute()
-        # Удаляем все связи с услугами
-        MasterService.delete().where(MasterService.master == master).execute()
-        # Удаляем мастера
-        master.delete_instance()
+        # Мастер, его записи, связи и строки каталога удаляются вместе
+        with write_transaction():
+            master = unit_of_work().get(Master, master_id)
+            # Удаляем все связанные записи вместе с их услугами, включая архивные
+            appointment_ids = Appointment.select(Appointment.id).where(Appointment.master == master)
+            archived_ids = ArchivedAppointment.select(ArchivedAppointment.id).where(ArchivedAppointment.master == master)
+            AppointmentCatalog.delete().where(
+                AppointmentCatalog.appointment_id.in_(appointment_ids) |
+                AppointmentCatalog.appointment_id.in_(archived_ids)).execute()
+            AppointmentService.delete().where(AppointmentService.appointment.in_(appointment_ids)).execute()
+            Appointment.delete().where(Appointment.master == master).execute()
+            ArchivedAppointmentService.delete().where(ArchivedAppointmentService.appointment.in_(archived_ids)).execute()
+            ArchivedAppointment.delete().where(ArchivedAppointment.master == master).execute()
+            # Удаляем все связи с услугами
+            MasterService.delete().where(MasterService.master == master).execute()
+            MasterCatalog.delete().where(MasterCatalog.master == master).execute()
+            # Удаляем мастера
+            master.delete_instance()
         return Response(
             json.dumps({"message": "Мастер удален"}, ensure_ascii=False),
             status=200,
@@ -0,0 +1,134 @@
+"""Запись обезличенного трафика и подсчет SQL-запросов.
+
+Включается переменными окружения при запуске app.py:
+    CAPTURE_LOG=traffic.jsonl.gz   - писать каждый запрос в журнал
+    CAPTURE_SECRET=...             - ключ HMAC для псевдонимов персональных данных
+    QUERY_COUNT_HEADER=1           - отдавать число SQL-запросов в заголовке X-Query-Count
+
+Псевдонимы - HMAC-SHA256 от значения: без ключа телефоны из журнала не
+подобрать перебором. Ключ в журнал не пишется. Если CAPTURE_SECRET не задан,
+ключ случайный на процесс, и псевдонимы совпадают только в пределах одного запуска.
+
+Журнал воспроизводится командой replay.py.
+"""
+from flask import g, request
+from contextvars import ContextVar
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from auth import USERS
+from models import db
+
+QUERY_COUNT_HEADER = 'X-Query-Count'
+# Заголовки, влияющие на ответ; api_key не пишется, вместо него роль
+CAPTURED_HEADERS = ('Accept', 'Idempotency-Key')
+# Персональные данные в телах запросов заменяются псевдонимами
+PERSONAL_FIELDS = {'client_name', 'client_phone', 'first_name', 'last_name', 'middle_name', 'phone', 'comment'}
+# Псевдоним помещается в самую короткую из этих колонок, phone и client_phone VARCHAR(20)
+PSEUDONYM_PREFIX = 'anon-'
+PSEUDONYM_LENGTH = 20
+
+CAPTURE_SECRET_ENV = 'CAPTURE_SECRET'
+
+_query_count = ContextVar('query_count', default=0)
+_secret = os.environ.get(CAPTURE_SECRET_ENV, '').encode('utf-8') or os.urandom(32)
+
+def set_secret(secret):
+    """Задает ключ HMAC для псевдонимов"""
+    global _secret
+    _secret = secret.encode('utf-8') if isinstance(secret, str) else secret
+
+def anonymize(value, key=None):
+    """Заменяет персональные поля стабильным псевдонимом, который проходит в те же колонки"""
+    if isinstance(value, dict):
+        return {k: anonymize(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [anonymize(v, key) for v in value]
+    if key in PERSONAL_FIELDS and isinstance(value, str) and value:
+        digest = hmac.new(_secret, value.encode('utf-8'), hashlib.sha256).hexdigest()
+        # Одинаковые значения дают одинаковый псевдоним, поэтому уникальность телефонов сохраняется
+        return PSEUDONYM_PREFIX + digest[:PSEUDONYM_LENGTH - len(PSEUDONYM_PREFIX)]
+    return value
+
+def _role(api_key):
+    return next((user['role'] for user in USERS if user['api_key'] == api_key), None)
+
+def open_log(path, mode):
+    """Открывает журнал; файлы .gz сжимаются"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+def init_query_counter(app):
+    """Считает SQL-запросы каждого HTTP-запроса и отдает их в X-Query-Count"""
+    if 'query_counter' in app.extensions:
+        return
+    app.extensions['query_counter'] = True
+    execute_sql = db.execute_sql
+
+    def counting_execute_sql(*args, **kwargs):
+        _query_count.set(_query_count.get() + 1)
+        return execute_sql(*args, **kwargs)
+
+    db.execute_sql = counting_execute_sql
+
+    @app.before_request
+    def reset_query_count():
+        _query_count.set(0)
+
+    @app.after_request
+    def add_query_count(response):
+        # У потокового ответа запросы к базе идут уже после отправки заголовков
+        if not response.is_streamed:
+            response.headers[QUERY_COUNT_HEADER] = str(_query_count.get())
+        return response
+
+def query_count():
+    """Число SQL-запросов текущего HTTP-запроса"""
+    return _query_count.get()
+
+def init_capture(app, path):
+    """Пишет каждый запрос к приложению строкой JSON в журнал path"""
+    init_query_counter(app)
+    if app.config.get(CAPTURE_SECRET_ENV):
+        set_secret(app.config[CAPTURE_SECRET_ENV])
+    log = open_log(path, 'a')
+    lock = threading.Lock()
+
+    @app.before_request
+    def start_capture():
+        g.capture_started = time.perf_counter()
+
+    @app.after_request
+    def write_capture(response):
+        started = g.pop('capture_started', None)
+        if started is None:
+            return response
+        body = request.get_json(silent=True)
+        record = {
+            't': round(time.time(), 3),
+            'm': request.method,
+            'p': request.path,
+            'q': request.query_string.decode('utf-8'),
+            'e': request.endpoint,
+            'r': _role(request.headers.get('api_key')),
+            'h': {name: request.headers[name] for name in CAPTURED_HEADERS if name in request.headers},
+            'b': anonymize(body) if body is not None else None,
+            's': response.status_code,
+        }
+
+        def write():
+            # Пишем после отдачи тела: потоковые списки читают базу уже после after_request
+            record['ms'] = round((time.perf_counter() - started) * 1000, 3)
+            record['n'] = _query_count.get()
+            line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+            with lock:
+                log.write(line + '\n')
+                log.flush()
+
+        response.call_on_close(write)
+        return response
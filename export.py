@@ -0,0 +1,150 @@
+"""Выгрузка всей истории для BI в колоночном формате.
+
+Каждая таблица пишется в отдельный файл каталога назначения:
+Arrow IPC (.arrow) или Parquet (.parquet), если установлен pyarrow,
+иначе типизированный CSV (.csv), где в заголовке указан тип колонки.
+В CSV NULL пишется как \\N, чтобы отличаться от пустой строки; строки,
+начинающиеся с обратной косой черты, получают еще одну в начале.
+
+Все таблицы читаются в одной транзакции; в PostgreSQL она открывается
+с уровнем REPEATABLE READ, иначе каждый курсор видел бы свой снимок.
+
+    python export.py export_dir --format arrow --chunk-size 50000
+"""
+import argparse
+import csv
+import os
+from decimal import Decimal
+from peewee import PostgresqlDatabase
+from models import (db, initialize_db, iterate_chunks, Master, Service, MasterService, Appointment,
+                    AppointmentService, ArchivedAppointment, ArchivedAppointmentService)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+CHUNK_SIZE = 50000
+CSV_NULL = '\\N'
+
+def _appointment_query():
+    fields = lambda model: (model.id, model.client_name, model.client_phone, model.date,
+                            model.status, model.comment, model.master)
+    return (Appointment.select(*fields(Appointment)) +
+            ArchivedAppointment.select(*fields(ArchivedAppointment)))
+
+def _appointment_service_query():
+    return (AppointmentService.select(AppointmentService.appointment, AppointmentService.service) +
+            ArchivedAppointmentService.select(ArchivedAppointmentService.appointment,
+                                              ArchivedAppointmentService.service))
+
+# Таблица -> (запрос, [(колонка, тип)]); порядок колонок совпадает с порядком полей в запросе
+TABLES = {
+    'master': (
+        lambda: Master.select(Master.id, Master.first_name, Master.last_name,
+                              Master.middle_name, Master.phone),
+        [('id', 'int'), ('first_name', 'str'), ('last_name', 'str'),
+         ('middle_name', 'str'), ('phone', 'str')]
+    ),
+    'service': (
+        lambda: Service.select(Service.id, Service.title, Service.description, Service.price),
+        [('id', 'int'), ('title', 'str'), ('description', 'str'), ('price', 'decimal')]
+    ),
+    'master_service': (
+        lambda: MasterService.select(MasterService.master, MasterService.service),
+        [('master_id', 'int'), ('service_id', 'int')]
+    ),
+    'appointment': (
+        _appointment_query,
+        [('id', 'int'), ('client_name', 'str'), ('client_phone', 'str'), ('date', 'datetime'),
+         ('status', 'str'), ('comment', 'str'), ('master_id', 'int')]
+    ),
+    'appointment_service': (
+        _appointment_service_query,
+        [('appointment_id', 'int'), ('service_id', 'int')]
+    ),
+}
+
+def iter_chunks(query, chunk_size=CHUNK_SIZE):
+    """Читает запрос курсором .tuples() и отдает колонки пачками по chunk_size строк"""
+    for chunk in iterate_chunks(query.tuples(), chunk_size):
+        yield list(zip(*chunk))
+
+def _arrow_schema(columns):
+    types = {
+        'int': pa.int64(),
+        'str': pa.string(),
+        'decimal': pa.decimal128(7, 2),
+        'datetime': pa.timestamp('us'),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+def _write_arrow(path, query, columns, chunk_size, fmt):
+    schema = _arrow_schema(columns)
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(path, schema)
+    else:
+        writer = pa.ipc.new_file(path, schema)
+    try:
+        for chunk in iter_chunks(query, chunk_size):
+            arrays = [pa.array(values, type=field.type) for values, field in zip(chunk, schema)]
+            batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+            writer.write_batch(batch)
+    finally:
+        writer.close()
+
+def _csv_value(value):
+    if value is None:
+        return CSV_NULL
+    if isinstance(value, str):
+        return '\\' + value if value.startswith('\\') else value
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+def _write_csv(path, query, columns, chunk_size):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([f'{name}:{kind}' for name, kind in columns])
+        for chunk in iter_chunks(query, chunk_size):
+            writer.writerows([_csv_value(v) for v in row] for row in zip(*chunk))
+
+def export_all(directory, fmt='arrow', chunk_size=CHUNK_SIZE):
+    """Выгружает мастеров, услуги, записи и таблицы связей в каталог directory"""
+    if fmt != 'csv' and pa is None:
+        fmt = 'csv'
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    # Одна транзакция, чтобы все таблицы выгружались из одного снимка базы
+    with db.atomic():
+        if isinstance(db, PostgresqlDatabase):
+            # При READ COMMITTED снимок берется заново для каждого запроса
+            db.execute_sql('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        for table, (make_query, columns) in TABLES.items():
+            path = os.path.join(directory, f'{table}.{fmt}')
+            if fmt == 'csv':
+                _write_csv(path, make_query(), columns, chunk_size)
+            else:
+                _write_arrow(path, make_query(), columns, chunk_size, fmt)
+            paths.append(path)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description='Колоночная выгрузка истории записей')
+    parser.add_argument('directory', help='Каталог для файлов выгрузки')
+    parser.add_argument('--format', choices=['arrow', 'parquet', 'csv'], default='arrow',
+                        help='Формат файлов; без pyarrow всегда используется csv')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    initialize_db()
+    for path in export_all(args.directory, args.format, args.chunk_size):
+        print(path)
+    db.close()
+
+if __name__ == '__main__':
+    main()
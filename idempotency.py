@@ -0,0 +1,92 @@
+"""Повтор POST-запросов по заголовку Idempotency-Key.
+
+Ответы хранятся в таблице idempotency_key общей базы (models.IdempotencyKey),
+поэтому повтор, попавший в другой воркер gunicorn или на другой узел, тоже
+получит сохраненный ответ. Ключ занимается в той же транзакции, в которой
+выполняется обработчик: одновременные повторы ждут ее завершения (в SQLite -
+блокировку записи, в PostgreSQL - уникальный индекс) и отдают уже сохраненный
+ответ, а при ошибке сервера ключ освобождается вместе с откатом изменений.
+"""
+from flask import Response, request, make_response
+from functools import wraps
+from datetime import datetime, timedelta
+from peewee import IntegrityError
+from models import db, IdempotencyKey, write_transaction
+import hashlib
+import json
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_TTL = 24 * 60 * 60
+
+
+def _store_key(idempotency_key):
+    """Ключ действует только в рамках одного клиента и одного маршрута;
+    API-ключ в базу не пишется, хранится только хэш"""
+    parts = (request.headers.get('api_key') or '', request.method, request.path, idempotency_key)
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _body_hash():
+    return hashlib.sha256(request.get_data()).hexdigest()
+
+
+def _mismatch():
+    return Response(
+        json.dumps({"error": "Idempotency-Key уже использован с другим телом запроса"}, ensure_ascii=False),
+        status=422,
+        mimetype="application/json; charset=utf-8"
+    )
+
+
+def _replay(stored, body_hash):
+    if stored.body_hash != body_hash:
+        return _mismatch()
+    response = Response(bytes(stored.body), status=stored.status, headers=json.loads(stored.headers))
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def purge_expired(now=None):
+    """Удаляет ответы с истекшим сроком хранения"""
+    now = now or datetime.now()
+    return IdempotencyKey.delete().where(IdempotencyKey.expires_at <= now).execute()
+
+
+def idempotent(f):
+    """Декоратор: повтор запроса с тем же Idempotency-Key возвращает сохраненный ответ"""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not idempotency_key:
+            return f(*args, **kwargs)
+
+        key = _store_key(idempotency_key)
+        body_hash = _body_hash()
+        now = datetime.now()
+        with write_transaction() as transaction:
+            purge_expired(now)
+            stored = IdempotencyKey.get_or_none(IdempotencyKey.key == key)
+            if stored is not None:
+                return _replay(stored, body_hash)
+            try:
+                with db.atomic():
+                    IdempotencyKey.create(key=key, body_hash=body_hash,
+                                          expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL))
+            except IntegrityError:
+                # Ключ занял параллельный запрос, и его транзакция уже завершилась
+                return _replay(IdempotencyKey.get_by_id(key), body_hash)
+
+            response = make_response(f(*args, **kwargs))
+            # Ошибки сервера не сохраняем, чтобы повтор мог пройти успешно
+            if response.status_code >= 500:
+                transaction.rollback()
+                return response
+            headers = [(k, v) for k, v in response.headers.items()
+                       if k.lower() not in ('content-length', 'set-cookie')]
+            IdempotencyKey.update(
+                status=response.status_code,
+                body=response.get_data(),
+                headers=json.dumps(headers)
+            ).where(IdempotencyKey.key == key).execute()
+            return response
+    return wrapper
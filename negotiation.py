@@ -0,0 +1,59 @@
+from flask import Response, request, jsonify, current_app, stream_with_context
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+CBOR_MIMETYPE = 'application/cbor'
+
+def available_mimetypes():
+    """Форматы ответа, доступные с установленными библиотеками"""
+    mimetypes = [JSON_MIMETYPE]
+    if msgpack is not None:
+        mimetypes.extend(MSGPACK_MIMETYPES)
+    if cbor2 is not None:
+        mimetypes.append(CBOR_MIMETYPE)
+    return mimetypes
+
+def negotiated(payload, status=200):
+    """Отдает payload в формате из заголовка Accept: JSON, MessagePack или CBOR"""
+    mimetype = request.accept_mimetypes.best_match(available_mimetypes(), default=JSON_MIMETYPE)
+    if mimetype in MSGPACK_MIMETYPES:
+        response = Response(msgpack.packb(payload, use_bin_type=True), mimetype=mimetype)
+    elif mimetype == CBOR_MIMETYPE:
+        response = Response(cbor2.dumps(payload), mimetype=mimetype)
+    else:
+        response = jsonify(payload)
+    response.status_code = status
+    response.vary.add('Accept')
+    return response
+
+def negotiated_stream(key, chunks, status=200):
+    """Отдает {key: [...]} из пачек элементов chunks. JSON пишется в ответ потоком
+    по мере чтения пачек; MessagePack и CBOR требуют длину массива заранее,
+    поэтому для них список собирается целиком"""
+    mimetype = request.accept_mimetypes.best_match(available_mimetypes(), default=JSON_MIMETYPE)
+    if mimetype != JSON_MIMETYPE:
+        return negotiated({key: [item for chunk in chunks for item in chunk]}, status)
+
+    def generate():
+        yield '{' + json.dumps(key) + ':['
+        separator = ''
+        for chunk in chunks:
+            if chunk:
+                yield separator + ','.join(current_app.json.dumps(item, separators=(',', ':')) for item in chunk)
+                separator = ','
+        yield ']}\n'
+
+    response = Response(stream_with_context(generate()), status=status, mimetype=JSON_MIMETYPE)
+    response.vary.add('Accept')
+    return response
@@ -0,0 +1,78 @@
+"""Временный PostgreSQL для бенчмарков и проверок.
+
+Поднимает кластер через initdb/pg_ctl, если они есть в PATH,
+иначе контейнер через docker. Возвращает DATABASE_URL для models.py.
+"""
+import contextlib
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+POSTGRES_IMAGE = 'postgres:16'
+STARTUP_TIMEOUT = 30
+
+def _cluster_available():
+    # initdb отказывается работать от root
+    return bool(shutil.which('initdb') and shutil.which('pg_ctl')) and os.geteuid() != 0
+
+def available():
+    """Можно ли поднять временный PostgreSQL на этой машине"""
+    return _cluster_available() or bool(shutil.which('docker'))
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _wait_for(port):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        with contextlib.suppress(OSError), socket.create_connection(('127.0.0.1', port), timeout=1):
+            # Порт открылся, даем серверу закончить запуск
+            time.sleep(1)
+            return
+        time.sleep(0.5)
+    raise RuntimeError(f"PostgreSQL не запустился на порту {port}")
+
+@contextlib.contextmanager
+def _cluster(port):
+    with tempfile.TemporaryDirectory() as data_dir:
+        subprocess.run(['initdb', '-D', data_dir, '-U', 'postgres', '-A', 'trust'],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run(['pg_ctl', '-D', data_dir, '-w', '-l', f'{data_dir}/server.log',
+                        '-o', f"-p {port} -k {data_dir} -c listen_addresses=127.0.0.1", 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        try:
+            yield
+        finally:
+            subprocess.run(['pg_ctl', '-D', data_dir, '-m', 'fast', 'stop'],
+                           check=False, stdout=subprocess.DEVNULL)
+
+@contextlib.contextmanager
+def _container(port):
+    container_id = subprocess.run(
+        ['docker', 'run', '-d', '--rm', '-e', 'POSTGRES_HOST_AUTH_METHOD=trust',
+         '-p', f'127.0.0.1:{port}:5432', POSTGRES_IMAGE],
+        check=True, capture_output=True, text=True
+    ).stdout.strip()
+    try:
+        _wait_for(port)
+        yield
+    finally:
+        subprocess.run(['docker', 'stop', container_id], check=False, stdout=subprocess.DEVNULL)
+
+@contextlib.contextmanager
+def temporary_postgres():
+    """Контекст с временным PostgreSQL; отдает URL для DATABASE_URL"""
+    port = _free_port()
+    if _cluster_available():
+        server = _cluster(port)
+    elif shutil.which('docker'):
+        server = _container(port)
+    else:
+        raise RuntimeError("Не найдены initdb/pg_ctl (под непривилегированным пользователем) или docker")
+    with server:
+        yield f'postgresext+pool://postgres@127.0.0.1:{port}/postgres'
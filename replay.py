@@ -0,0 +1,280 @@
+"""Воспроизведение записанного трафика и сравнение задержек между сборками.
+
+Журнал пишется приложением при CAPTURE_LOG=traffic.jsonl.gz (см. capture.py).
+
+    python replay.py traffic.jsonl.gz --output new.json --baseline old.json
+    python replay.py traffic.jsonl.gz --speed 10 --concurrency 8
+    python replay.py traffic.jsonl.gz --url http://127.0.0.1:5000
+    python replay.py traffic.jsonl.gz --repeat 5 --concurrency 1 --baseline old.json
+
+Перед замером журнал прогоняется --warmup раз без пауз, эти прогоны в отчет
+не идут; --repeat повторяет замер, чтобы набрать выборку. Регрессией задержки
+считается рост больше --threshold и одновременно больше --min-delta-ms,
+маршруты с числом замеров меньше --min-samples по задержке не сравниваются.
+Baseline нужно снимать с теми же --repeat и --concurrency: повторы добавляют
+записанные POST в базу, а параллельные потоки тестового клиента делят GIL
+и дают разброс в несколько мс, поэтому для сравнения сборок лучше --concurrency 1.
+
+Без --url запросы идут через тестовый клиент во временную базу SQLite
+(или в --database-url). Во временной базе есть только начальные данные,
+поэтому запросы к записанным /<id> чаще всего получают 404 - для сравнения
+сборок лучше указывать копию рабочей базы или --url. Сервер для --url стоит
+запускать с QUERY_COUNT_HEADER=1, иначе число SQL-запросов в отчете будет
+пустым; для потоковых списков сервер заголовок не отдает, и в режиме --url
+их число тоже пустое.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from auth import USERS
+from capture import QUERY_COUNT_HEADER, open_log, init_query_counter, query_count
+
+# Маршруты, по которым ищутся регрессии
+WATCHED_BLUEPRINTS = ('masters.', 'appointments.')
+REGRESSION_THRESHOLD = 0.1
+# Меньше замеров по маршруту - процентили не сравниваются, это шум
+MIN_SAMPLES = 20
+# Рост задержки меньше этого порога (мс) регрессией не считается
+MIN_DELTA_MS = 5.0
+WARMUP_PASSES = 1
+
+API_KEYS = {user['role']: user['api_key'] for user in USERS}
+
+def read_log(path):
+    with open_log(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def _headers(record):
+    headers = dict(record.get('h') or {})
+    if record.get('r') in API_KEYS:
+        headers['api_key'] = API_KEYS[record['r']]
+    if record.get('b') is not None:
+        headers['Content-Type'] = 'application/json'
+    return headers
+
+def _body(record):
+    if record.get('b') is None:
+        return None
+    return json.dumps(record['b'], ensure_ascii=False).encode('utf-8')
+
+def _target(record):
+    return record['p'] + ('?' + record['q'] if record.get('q') else '')
+
+class TestClientSender:
+    """Отправляет запросы в приложение в этом же процессе"""
+
+    def __init__(self):
+        from app import app
+        init_query_counter(app)
+        self.app = app
+        self.local = threading.local()
+
+    def __call__(self, record):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        started = time.perf_counter()
+        response = client.open(_target(record), method=record['m'],
+                               headers=_headers(record), data=_body(record))
+        # Списки отдаются потоком: запросы к базе идут, пока читается тело
+        response.get_data()
+        response.close()
+        elapsed = (time.perf_counter() - started) * 1000
+        # Тестовый клиент выполняет приложение в этом же потоке, поэтому
+        # счетчик виден и после потокового тела, в отличие от заголовка
+        return response.status_code, elapsed, query_count()
+
+class HttpSender:
+    """Отправляет запросы на запущенный сервер"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def __call__(self, record):
+        request = urllib.request.Request(self.url + _target(record), data=_body(record),
+                                         headers=_headers(record), method=record['m'])
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                status, headers = response.status, response.headers
+        except urllib.error.HTTPError as e:
+            e.read()
+            status, headers = e.code, e.headers
+        elapsed = (time.perf_counter() - started) * 1000
+        queries = headers.get(QUERY_COUNT_HEADER)
+        return status, elapsed, int(queries) if queries is not None else None
+
+def for_pass(records, tag):
+    """Копии записей с Idempotency-Key, уникальным для прохода: иначе повторный
+    проход получал бы сохраненные ответы и не измерял запись в базу"""
+    result = []
+    for record in records:
+        key = (record.get('h') or {}).get('Idempotency-Key')
+        if key:
+            record = {**record, 'h': {**record['h'], 'Idempotency-Key': f'{key}-{tag}'}}
+        result.append(record)
+    return result
+
+def replay(records, send, speed=1.0, concurrency=1):
+    """Воспроизводит записи с исходными интервалами, ускоренными в speed раз
+    (speed=0 - без пауз). Возвращает [(маршрут, статус, мс, SQL-запросов)]"""
+    results = []
+    lock = threading.Lock()
+
+    def run(record):
+        status, elapsed, queries = send(record)
+        route = f"{record['m']} {record.get('e') or record['p']}"
+        with lock:
+            results.append((route, status, elapsed, queries))
+
+    records = sorted(records, key=lambda record: record['t'])
+    futures = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.monotonic()
+        first = records[0]['t'] if records else 0
+        for record in records:
+            if speed > 0:
+                delay = (record['t'] - first) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(pool.submit(run, record))
+    # Ошибки отправки (например, недоступный сервер) не должны теряться в потоках
+    for future in futures:
+        future.result()
+    return results
+
+def _percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+def summarize(results):
+    """Распределение задержек и число SQL-запросов по маршрутам"""
+    routes = defaultdict(list)
+    for route, status, elapsed, queries in results:
+        routes[route].append((status, elapsed, queries))
+    report = {}
+    for route, items in sorted(routes.items()):
+        latencies = [elapsed for _, elapsed, _ in items]
+        queries = [q for _, _, q in items if q is not None]
+        report[route] = {
+            'count': len(items),
+            'errors': sum(1 for status, _, _ in items if status >= 500),
+            'p50': round(_percentile(latencies, 50), 3),
+            'p90': round(_percentile(latencies, 90), 3),
+            'p99': round(_percentile(latencies, 99), 3),
+            'max': round(max(latencies), 3),
+            'queries': round(sum(queries) / len(queries), 2) if queries else None,
+        }
+    return report
+
+def _watched(route):
+    return route.split(' ', 1)[1].startswith(WATCHED_BLUEPRINTS)
+
+def undersampled(report, baseline, min_samples=MIN_SAMPLES):
+    """Отслеживаемые маршруты, у которых задержки не сравниваются из-за малой выборки"""
+    return [route for route, stats in report.items()
+            if route in baseline and _watched(route)
+            and min(stats['count'], baseline[route]['count']) < min_samples]
+
+def diff(report, baseline, threshold=REGRESSION_THRESHOLD, min_samples=MIN_SAMPLES,
+         min_delta_ms=MIN_DELTA_MS):
+    """Список регрессий отслеживаемых маршрутов относительно baseline"""
+    regressions = []
+    for route, stats in report.items():
+        old = baseline.get(route)
+        if old is None or not _watched(route):
+            continue
+        if min(stats['count'], old['count']) >= min_samples:
+            for metric in ('p50', 'p90'):
+                if (old[metric] and stats[metric] > old[metric] * (1 + threshold)
+                        and stats[metric] - old[metric] > min_delta_ms):
+                    regressions.append(f"{route}: {metric} {old[metric]} -> {stats[metric]} мс")
+        if old['queries'] is not None and stats['queries'] is not None and stats['queries'] > old['queries']:
+            regressions.append(f"{route}: SQL-запросов {old['queries']} -> {stats['queries']}")
+        if stats['errors'] > old['errors']:
+            regressions.append(f"{route}: ошибок 5xx {old['errors']} -> {stats['errors']}")
+    return regressions
+
+def print_report(report):
+    print(f"{'маршрут':<45}{'n':>6}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'sql':>8}")
+    for route, stats in report.items():
+        queries = '-' if stats['queries'] is None else stats['queries']
+        print(f"{route:<45}{stats['count']:>6}{stats['p50']:>10}{stats['p90']:>10}"
+              f"{stats['p99']:>10}{stats['max']:>10}{queries:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Воспроизведение записанного трафика')
+    parser.add_argument('log', help='Журнал, записанный с CAPTURE_LOG')
+    parser.add_argument('--url', help='Адрес запущенного сервера вместо тестового клиента')
+    parser.add_argument('--database-url', help='База для тестового клиента (по умолчанию временный SQLite)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Ускорение относительно записи; 0 - без пауз')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--output', help='Сохранить отчет в JSON')
+    parser.add_argument('--baseline', help='Отчет предыдущего прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='Допустимый рост p50/p90, доля (0.1 = 10%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=MIN_DELTA_MS,
+                        help='Рост p50/p90 меньше этого числа мс не считается регрессией')
+    parser.add_argument('--min-samples', type=int, default=MIN_SAMPLES,
+                        help='Минимум замеров маршрута для сравнения задержек')
+    parser.add_argument('--repeat', type=int, default=1, help='Сколько раз воспроизвести журнал для замера')
+    parser.add_argument('--warmup', type=int, default=WARMUP_PASSES,
+                        help='Прогоны без пауз перед замером, в отчет не входят')
+    args = parser.parse_args()
+
+    records = read_log(args.log)
+    if args.url:
+        send = HttpSender(args.url)
+    else:
+        if not args.database_url:
+            print("Внимание: без --database-url и --url журнал идет во временную базу "
+                  "с начальными данными, запросы к записанным /<id> получат 404", file=sys.stderr)
+        # Пишущие запросы не должны попадать в рабочую базу
+        if args.database_url:
+            os.environ['DATABASE_URL'] = args.database_url
+        for name in ('output', 'baseline'):
+            if getattr(args, name):
+                setattr(args, name, os.path.abspath(getattr(args, name)))
+        os.chdir(tempfile.mkdtemp())
+        send = TestClientSender()
+
+    # Метка запуска отделяет ключи от прошлых прогонов на том же сервере (--url)
+    run = uuid.uuid4().hex[:8]
+    # Первые запросы прогревают импорты, соединения и кэши и искажают процентили
+    for pass_no in range(args.warmup):
+        replay(for_pass(records, f'{run}-w{pass_no}'), send, 0, args.concurrency)
+    results = []
+    for pass_no in range(args.repeat):
+        results.extend(replay(for_pass(records, f'{run}-{pass_no}'), send, args.speed, args.concurrency))
+    report = summarize(results)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        for route in undersampled(report, baseline, args.min_samples):
+            print(f"Мало замеров для сравнения задержек: {route} (нужно {args.min_samples}, "
+                  f"см. --repeat)", file=sys.stderr)
+        regressions = diff(report, baseline, args.threshold, args.min_samples, args.min_delta_ms)
+        for regression in regressions:
+            print(f"РЕГРЕССИЯ {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+"""Общая настройка тестов.
+
+models.py выбирает базу при импорте по DATABASE_URL, поэтому тесты,
+работающие с приложением в этом процессе, получают временный файл SQLite.
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['DATABASE_URL'] = f'sqlite:///{tempfile.mkdtemp()}/barbershop.db'
+
+ADMIN = {'api_key': 'admin_secret_key_123'}
+
+@pytest.fixture
+def client():
+    from app import app
+    return app.test_client()
+
+@pytest.fixture
+def phone():
+    """Уникальный телефон: мастера с одинаковым телефоном создать нельзя"""
+    return uuid.uuid4().hex[:12]
@@ -0,0 +1,84 @@
+"""Смоук-тест API и выгрузки на SQLite и, если его можно поднять, на PostgreSQL.
+
+models.py выбирает базу при импорте по DATABASE_URL, поэтому каждый бэкенд
+проверяется в отдельном процессе.
+"""
+import contextlib
+import importlib.util
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pgtemp
+
+SCENARIO = textwrap.dedent('''
+    import json
+    from datetime import datetime
+    from app import app
+    from models import archive_appointments
+    from export import export_all, CSV_NULL
+
+    client = app.test_client()
+    admin = {'api_key': 'admin_secret_key_123'}
+
+    response = client.post('/masters/', headers=admin, json={
+        'first_name': 'Тест', 'last_name': 'Тестов', 'phone': '000-000-0000', 'services': [1, 2]})
+    assert response.status_code == 201, response.data
+    master_id = response.get_json()['id']
+
+    for date in ('2020-01-01T10:00:00', '2030-01-01T10:00:00'):
+        response = client.post('/appointments/', headers=admin, json={
+            'client_name': 'Клиент', 'client_phone': '12345', 'master_id': master_id,
+            'date': date, 'services': [1, 2]})
+        assert response.status_code == 201, response.data
+
+    assert archive_appointments(datetime(2025, 1, 1)) == 1
+    hot = json.loads(client.get('/appointments/', headers=admin).data)['appointments']
+    everything = json.loads(client.get('/appointments/?include_archived=1', headers=admin).data)['appointments']
+    assert [a['total_price'] for a in hot] == ['1800.00']
+    assert len(everything) == 2 and len({a['id'] for a in everything}) == 2
+
+    masters = json.loads(client.get('/masters/', headers=admin).data)['masters']
+    assert [m['services'] for m in masters if m['id'] == master_id] == [[1, 2]]
+
+    export_all('export', 'csv')
+    with open('export/appointment.csv', encoding='utf-8') as f:
+        assert len(f.read().splitlines()) == 3
+    # NULL в CSV отличается от пустой строки
+    with open('export/master.csv', encoding='utf-8') as f:
+        assert f.read().splitlines()[-1] == f'{master_id},Тест,Тестов,{CSV_NULL},000-000-0000'
+    print('ok')
+''')
+
+def _postgres_ready():
+    return pgtemp.available() and importlib.util.find_spec('psycopg2') is not None
+
+@contextlib.contextmanager
+def _database(backend, tmp_path):
+    if backend == 'postgres':
+        with pgtemp.temporary_postgres() as url:
+            yield url
+    else:
+        yield f'sqlite:///{tmp_path}/barbershop.db'
+
+@pytest.mark.parametrize('backend', [
+    'sqlite',
+    pytest.param('postgres', marks=pytest.mark.skipif(
+        not _postgres_ready(), reason='нет initdb/pg_ctl или docker либо psycopg2')),
+])
+def test_smoke(backend, tmp_path):
+    with _database(backend, tmp_path) as url:
+        result = subprocess.run(
+            [sys.executable, '-c', SCENARIO],
+            cwd=tmp_path,
+            env={**os.environ, 'DATABASE_URL': url, 'PYTHONPATH': ROOT},
+            capture_output=True, text=True, timeout=120
+        )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().endswith('ok')
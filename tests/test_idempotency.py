@@ -0,0 +1,86 @@
+"""Повтор POST-запросов по Idempotency-Key (idempotency.py)."""
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import idempotency
+from conftest import ADMIN
+from models import Appointment, Master, IdempotencyKey
+
+def _appointment(**fields):
+    return {'client_name': 'Клиент', 'client_phone': '12345', 'master_id': 1,
+            'date': '2030-01-01T10:00:00', 'services': [1], **fields}
+
+def _headers():
+    return {**ADMIN, 'Idempotency-Key': uuid.uuid4().hex}
+
+def test_repeat_returns_stored_response(client, phone):
+    headers = _headers()
+    body = {'first_name': 'Тест', 'last_name': 'Тестов', 'phone': phone, 'services': [1, 2]}
+    first = client.post('/masters/', headers=headers, json=body)
+    second = client.post('/masters/', headers=headers, json=body)
+    assert first.status_code == second.status_code == 201
+    assert second.get_json() == first.get_json()
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert 'Idempotent-Replayed' not in first.headers
+    assert Master.select().where(Master.phone == phone).count() == 1
+
+def test_client_errors_are_stored(client, phone):
+    headers = _headers()
+    body = {'first_name': 'Тест', 'last_name': 'Тестов', 'phone': phone, 'services': [1, 1]}
+    first = client.post('/masters/', headers=headers, json=body)
+    second = client.post('/masters/', headers=headers, json=body)
+    assert first.status_code == second.status_code == 400
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert not Master.select().where(Master.phone == phone).exists()
+
+def test_changed_body_is_rejected(client):
+    headers = _headers()
+    assert client.post('/appointments/', headers=headers, json=_appointment()).status_code == 201
+    response = client.post('/appointments/', headers=headers, json=_appointment(client_name='Другой'))
+    assert response.status_code == 422
+
+def test_expired_key_runs_again(client):
+    headers = _headers()
+    first = client.post('/appointments/', headers=headers, json=_appointment())
+    IdempotencyKey.update(expires_at=datetime.now() - timedelta(seconds=1)).execute()
+    second = client.post('/appointments/', headers=headers, json=_appointment())
+    assert first.status_code == second.status_code == 201
+    assert 'Idempotent-Replayed' not in second.headers
+    assert second.get_json()['id'] != first.get_json()['id']
+
+def test_expired_keys_are_purged(client):
+    IdempotencyKey.update(expires_at=datetime.now() - timedelta(seconds=1)).execute()
+    client.post('/appointments/', headers=_headers(), json=_appointment())
+    assert IdempotencyKey.select().where(IdempotencyKey.expires_at <= datetime.now()).count() == 0
+
+def test_concurrent_repeats_run_once(client, monkeypatch):
+    make_response = idempotency.make_response
+
+    def slow_make_response(rv):
+        # Держим транзакцию первого запроса открытой, пока приходит второй
+        time.sleep(0.3)
+        return make_response(rv)
+
+    monkeypatch.setattr(idempotency, 'make_response', slow_make_response)
+    headers = _headers()
+    before = Appointment.select().count()
+    barrier = threading.Barrier(2)
+    responses = []
+
+    def send():
+        test_client = client.application.test_client()
+        barrier.wait()
+        responses.append(test_client.post('/appointments/', headers=headers, json=_appointment()))
+
+    threads = [threading.Thread(target=send) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [response.status_code for response in responses] == [201, 201]
+    assert responses[0].get_json() == responses[1].get_json()
+    assert sum('Idempotent-Replayed' in response.headers for response in responses) == 1
+    assert Appointment.select().count() == before + 1
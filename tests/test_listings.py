@@ -0,0 +1,37 @@
+"""Потоковые списки не должны блокировать запись (models.iterate)."""
+import threading
+from datetime import datetime
+
+from conftest import ADMIN
+from models import Appointment, APPOINTMENT_SEQUENCE, next_ids
+
+ROWS = 1200
+
+def test_slow_reader_does_not_block_writes(client, phone):
+    first_id = next_ids(APPOINTMENT_SEQUENCE, ROWS)
+    Appointment.insert_many([
+        {'id': first_id + i, 'client_name': 'Клиент', 'client_phone': '12345',
+         'date': datetime(2030, 1, 1), 'status': 'ожидает', 'master': 1}
+        for i in range(ROWS)
+    ]).execute()
+
+    response = client.get('/appointments/', headers=ADMIN, buffered=False)
+    body = iter(response.response)
+    # Клиент прочитал первую пачку записей, курсор по остальным еще открыт
+    next(body)
+    next(body)
+
+    result = {}
+
+    def write():
+        result['response'] = client.application.test_client().post('/masters/', headers=ADMIN, json={
+            'first_name': 'Тест', 'last_name': 'Тестов', 'phone': phone})
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    writer.join(timeout=3)
+    assert not writer.is_alive(), 'запись ждет, пока дочитают список'
+    assert result['response'].status_code == 201
+
+    list(body)
+    response.close()
@@ -0,0 +1,59 @@
+"""Число SQL-запросов: карта идентичности и пакетная запись связей (models.UnitOfWork)."""
+import pytest
+
+from conftest import ADMIN
+from models import db
+
+@pytest.fixture
+def statements(monkeypatch):
+    """Список (sql, params) всех запросов к базе во время теста"""
+    log = []
+    execute_sql = db.execute_sql
+
+    def logging_execute_sql(sql, params=None, *args, **kwargs):
+        log.append((sql, params or ()))
+        return execute_sql(sql, params, *args, **kwargs)
+
+    monkeypatch.setattr(db, 'execute_sql', logging_execute_sql)
+    return log
+
+def _matching(statements, prefix, table):
+    return [(sql, params) for sql, params in statements
+            if sql.startswith(prefix) and f'"{table}"' in sql.split(' WHERE ')[0]]
+
+def _appointment(client, **fields):
+    response = client.post('/appointments/', headers=ADMIN, json={
+        'client_name': 'Клиент', 'client_phone': '12345', 'master_id': 1,
+        'date': '2030-01-01T10:00:00', **fields})
+    assert response.status_code == 201, response.data
+    return response.get_json()['id']
+
+def test_listing_loads_each_master_once(client, statements):
+    for master_id in (1, 2, 1, 2):
+        _appointment(client, master_id=master_id)
+    statements.clear()
+
+    appointments = client.get('/appointments/', headers=ADMIN).get_json()['appointments']
+    loaded = [pk for _, params in _matching(statements, 'SELECT', 'master') for pk in params]
+    assert sorted(loaded) == sorted({a['master']['id'] for a in appointments})
+
+def test_update_reads_master_once(client, statements):
+    appointment_id = _appointment(client)
+    statements.clear()
+
+    response = client.put(f'/appointments/{appointment_id}', headers=ADMIN, json={'master_id': 2})
+    assert response.get_json()['master'] == 2
+    assert len(_matching(statements, 'SELECT', 'master')) == 1
+    assert len(_matching(statements, 'SELECT', 'appointment')) == 1
+
+def test_links_are_written_in_one_insert(client, statements, phone):
+    response = client.post('/masters/', headers=ADMIN, json={
+        'first_name': 'Тест', 'last_name': 'Тестов', 'phone': phone, 'services': [1, 2, 3]})
+    assert response.status_code == 201
+    assert len(_matching(statements, 'INSERT', 'masterservice')) == 1
+
+    appointment_id = _appointment(client)
+    statements.clear()
+    client.put(f'/appointments/{appointment_id}', headers=ADMIN, json={'services': [1, 2, 3]})
+    assert len(_matching(statements, 'DELETE', 'appointmentservice')) == 1
+    assert len(_matching(statements, 'INSERT', 'appointmentservice')) == 1